@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+"""
+Serviço de deploy de longa duração em torno do AutoDeploy.
+
+Expõe uma API HTTP local para disparar deploys (webhook do GitHub, comando de chat, etc.),
+mantém uma fila persistente de jobs (SQLite) processada por um pool limitado de workers e
+garante que dois deploys do mesmo projeto nunca rodem ao mesmo tempo. Pedidos repetidos
+para um projeto que já tem um job na fila são agrupados em um único deploy do último commit.
+
+Endpoints:
+    POST /deploy              {"project": "BotEngaja", "commit": "abc123"}
+    POST /webhook/github      payload de push do GitHub
+    GET  /jobs                últimos jobs
+    GET  /jobs/<id>           status de um job
+    GET  /jobs/<id>/log       log do job (transmitido até o job terminar)
+
+Uso: deploy_service.py [--config service.json]
+"""
+import os
+import re
+import sys
+import json
+import time
+import hmac
+import sqlite3
+import hashlib
+import argparse
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+DEPLOY_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'deploy.py')
+
+# Formato aceito para commits (o valor vai para a linha de comando remota)
+COMMIT_PATTERN = re.compile(r'^[0-9a-f]{7,40}$')
+
+
+class DeployService:
+    def __init__(self,
+                 projects: List[str],
+                 state_dir: str = "~/.autodeploy/service",
+                 workers: int = 2,
+                 coalesce_window: float = 10.0,
+                 coalesce_max_delay: float = 60.0,
+                 job_timeout: int = 1800):
+        # Projetos gerenciados (nome do projeto = nome da pasta, como no AutoDeploy)
+        self.projects = {os.path.basename(os.path.abspath(p)): os.path.abspath(p) for p in projects}
+
+        # Estado persistente (fila de jobs e logs)
+        self.state_dir = os.path.expanduser(state_dir)
+        self.logs_dir = os.path.join(self.state_dir, 'logs')
+        os.makedirs(self.logs_dir, exist_ok=True)
+        self.db_path = os.path.join(self.state_dir, 'jobs.db')
+
+        # Pool de workers
+        self.workers = workers
+        self.coalesce_window = coalesce_window
+        self.coalesce_max_delay = coalesce_max_delay
+        self.job_timeout = job_timeout
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.running_projects = set()
+
+        self.init_db()
+
+    def connect(self) -> sqlite3.Connection:
+        """Abre uma conexão com o banco de jobs"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def init_db(self) -> None:
+        """Cria a tabela de jobs e recoloca na fila jobs interrompidos por um restart"""
+        with self.connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    project TEXT NOT NULL,
+                    commit_sha TEXT,
+                    source TEXT,
+                    status TEXT NOT NULL,
+                    requests INTEGER NOT NULL DEFAULT 1,
+                    created_at REAL NOT NULL,
+                    not_before REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    exit_code INTEGER
+                )
+            """)
+            interrupted = conn.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'"
+            ).rowcount
+        if interrupted:
+            print(f"♻️ {interrupted} job(s) interrompido(s) recolocado(s) na fila")
+
+    def job_to_dict(self, row: sqlite3.Row) -> Dict:
+        """Converte uma linha da tabela em dicionário para a API"""
+        job = dict(row)
+        job['commit'] = job.pop('commit_sha')
+        return job
+
+    def enqueue(self, project: str, commit: Optional[str] = None, source: str = "api") -> Dict:
+        """
+        Adiciona um deploy na fila. Se o projeto já tem um job aguardando, o pedido é
+        agrupado nele (passa a implantar o commit mais recente) em vez de criar outro.
+        Levanta KeyError para projeto desconhecido e ValueError para commit inválido.
+        """
+        if project not in self.projects:
+            raise KeyError(project)
+        if commit is not None and not (isinstance(commit, str) and COMMIT_PATTERN.match(commit)):
+            raise ValueError(f"commit inválido: {commit!r}")
+
+        now = time.time()
+        with self.wakeup:
+            with self.connect() as conn:
+                queued = conn.execute(
+                    "SELECT * FROM jobs WHERE project = ? AND status = 'queued' ORDER BY id LIMIT 1",
+                    (project,)
+                ).fetchone()
+
+                if queued:
+                    # Cada pedido adia o job, mas nunca além de coalesce_max_delay desde a criação
+                    not_before = min(now + self.coalesce_window,
+                                     queued['created_at'] + self.coalesce_max_delay)
+                    conn.execute(
+                        "UPDATE jobs SET commit_sha = ?, source = ?, requests = requests + 1, not_before = ? WHERE id = ?",
+                        (commit, source, not_before, queued['id'])
+                    )
+                    job_id = queued['id']
+                    print(f"🔗 Deploy de {project} agrupado no job #{job_id}")
+                else:
+                    job_id = conn.execute(
+                        "INSERT INTO jobs (project, commit_sha, source, status, created_at, not_before) "
+                        "VALUES (?, ?, ?, 'queued', ?, ?)",
+                        (project, commit, source, now, now + self.coalesce_window)
+                    ).lastrowid
+                    print(f"📥 Job #{job_id} criado para {project}")
+
+                job = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            self.wakeup.notify_all()
+        return self.job_to_dict(job)
+
+    def get_job(self, job_id: int) -> Optional[Dict]:
+        """Retorna um job pelo id"""
+        with self.connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self.job_to_dict(row) if row else None
+
+    def list_jobs(self, limit: int = 50) -> List[Dict]:
+        """Retorna os jobs mais recentes"""
+        with self.connect() as conn:
+            rows = conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [self.job_to_dict(row) for row in rows]
+
+    def log_path(self, job_id: int) -> str:
+        """Arquivo de log de um job"""
+        return os.path.join(self.logs_dir, f"{job_id}.log")
+
+    def claim_next_job(self) -> Optional[Dict]:
+        """
+        Pega o próximo job pronto cujo projeto não esteja em execução (serialização por
+        projeto). Deve ser chamado com self.lock adquirido.
+        """
+        with self.connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' AND not_before <= ? ORDER BY id",
+                (time.time(),)
+            ).fetchall()
+            for row in rows:
+                if row['project'] in self.running_projects:
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?",
+                    (time.time(), row['id'])
+                )
+                self.running_projects.add(row['project'])
+                return self.job_to_dict(row)
+        return None
+
+    def next_wakeup(self) -> float:
+        """
+        Segundos até o próximo job da fila ficar pronto (máximo de 5s). Jobs de projetos
+        em execução são ignorados: o worker que termina o deploy já acorda os demais.
+        Deve ser chamado com self.lock adquirido.
+        """
+        running = list(self.running_projects)
+        placeholders = ", ".join("?" for _ in running)
+        query = "SELECT MIN(not_before) FROM jobs WHERE status = 'queued'"
+        if running:
+            query += f" AND project NOT IN ({placeholders})"
+        with self.connect() as conn:
+            row = conn.execute(query, running).fetchone()
+        if row[0] is None:
+            return 5.0
+        return min(5.0, max(0.1, row[0] - time.time()))
+
+    def checkout_commit(self, project_path: str, commit: Optional[str], log) -> Optional[str]:
+        """
+        Atualiza o checkout local para o commit do job (ou para o último commit da branch
+        padrão do remoto), para que deploy.json, arquivo de entrada e demais detecções
+        locais correspondam ao código implantado. Retorna o commit ou None em caso de falha.
+        """
+        commands = [["git", "fetch", "origin"] + ([] if commit else ["HEAD"])]
+        commands.append(["git", "checkout", "--detach", commit or "FETCH_HEAD"])
+        for command in commands:
+            result = subprocess.run(command, cwd=project_path, stdout=log, stderr=subprocess.STDOUT)
+            if result.returncode != 0:
+                log.write(f"❌ Falha ao executar {' '.join(command)}\n".encode())
+                return None
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=project_path, text=True
+        ).strip()
+
+    def run_job(self, job: Dict) -> int:
+        """Executa o deploy em um processo separado, gravando a saída no log do job"""
+        project_path = self.projects[job['project']]
+        env = dict(os.environ, PYTHONUNBUFFERED='1')
+        with open(self.log_path(job['id']), 'ab') as log:
+            log.write(f"🚀 Job #{job['id']}: deploy de {job['project']} ({job['commit'] or 'HEAD'})\n".encode())
+            log.flush()
+
+            commit = self.checkout_commit(project_path, job['commit'], log)
+            if not commit:
+                return -1
+            command = [sys.executable, DEPLOY_SCRIPT, project_path, '--skip-github', '--commit', commit]
+
+            try:
+                process = subprocess.run(
+                    command, stdout=log, stderr=subprocess.STDOUT, env=env, timeout=self.job_timeout
+                )
+                return process.returncode
+            except subprocess.TimeoutExpired:
+                log.write(f"❌ Deploy excedeu o tempo limite de {self.job_timeout}s\n".encode())
+                return -1
+
+    def worker_loop(self) -> None:
+        """Loop de um worker: pega jobs prontos e executa até o serviço parar"""
+        while True:
+            with self.wakeup:
+                job = self.claim_next_job()
+                while job is None:
+                    self.wakeup.wait(self.next_wakeup())
+                    job = self.claim_next_job()
+
+            print(f"▶️ Executando job #{job['id']} ({job['project']})")
+            try:
+                exit_code = self.run_job(job)
+            except Exception as e:
+                print(f"❌ Erro ao executar job #{job['id']}: {e}")
+                exit_code = -1
+
+            status = 'success' if exit_code == 0 else 'failed'
+            with self.wakeup:
+                with self.connect() as conn:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, finished_at = ?, exit_code = ? WHERE id = ?",
+                        (status, time.time(), exit_code, job['id'])
+                    )
+                self.running_projects.discard(job['project'])
+                self.wakeup.notify_all()
+            print(f"{'✅' if status == 'success' else '❌'} Job #{job['id']} ({job['project']}): {status}")
+
+    def start_workers(self) -> None:
+        """Inicia o pool de workers"""
+        for i in range(self.workers):
+            threading.Thread(target=self.worker_loop, name=f"deploy-worker-{i}", daemon=True).start()
+
+
+class DeployRequestHandler(BaseHTTPRequestHandler):
+    """Handler HTTP da API do serviço de deploy"""
+    service: DeployService = None
+    api_token: Optional[str] = None
+    webhook_secret: Optional[str] = None
+
+    def send_json(self, status: int, data) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length) if length else b""
+
+    def is_authorized(self) -> bool:
+        """Valida o token da API (header Authorization: Bearer <token>)"""
+        if not self.api_token:
+            return True
+        expected = f"Bearer {self.api_token}"
+        return hmac.compare_digest(self.headers.get('Authorization', ''), expected)
+
+    def is_valid_signature(self, body: bytes) -> bool:
+        """Valida a assinatura X-Hub-Signature-256 do webhook do GitHub"""
+        if not self.webhook_secret:
+            return self.is_authorized()
+        digest = hmac.new(self.webhook_secret.encode(), body, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(self.headers.get('X-Hub-Signature-256', ''), f"sha256={digest}")
+
+    def do_POST(self):
+        body = self.read_body()
+
+        if self.path == '/webhook/github':
+            if not self.is_valid_signature(body):
+                return self.send_json(401, {'error': 'assinatura inválida'})
+            if self.headers.get('X-GitHub-Event') == 'ping':
+                return self.send_json(200, {'ok': True})
+            try:
+                payload = json.loads(body or b"{}")
+                project = payload['repository']['name']
+                default_branch = payload['repository'].get('default_branch', 'main')
+            except (ValueError, KeyError, TypeError, AttributeError):
+                return self.send_json(400, {'error': 'payload inválido'})
+            # Só implanta pushes na branch padrão (ignora outras branches, tags e exclusões)
+            if payload.get('ref') != f"refs/heads/{default_branch}" or payload.get('deleted'):
+                return self.send_json(200, {'ignored': True, 'ref': payload.get('ref')})
+            commit, source = payload.get('after'), 'github'
+
+        elif self.path == '/deploy':
+            if not self.is_authorized():
+                return self.send_json(401, {'error': 'não autorizado'})
+            try:
+                payload = json.loads(body or b"{}")
+                project = payload['project']
+            except (ValueError, KeyError, TypeError):
+                return self.send_json(400, {'error': 'informe "project"'})
+            commit, source = payload.get('commit'), payload.get('source', 'api')
+
+        else:
+            return self.send_json(404, {'error': 'rota não encontrada'})
+
+        try:
+            job = self.service.enqueue(project, commit, source)
+        except KeyError:
+            return self.send_json(404, {'error': f'projeto {project} não gerenciado por este serviço'})
+        except ValueError as e:
+            return self.send_json(400, {'error': str(e)})
+        self.send_json(202, job)
+
+    def do_GET(self):
+        if not self.is_authorized():
+            return self.send_json(401, {'error': 'não autorizado'})
+
+        parts = [p for p in self.path.split('?')[0].split('/') if p]
+        if parts == ['jobs']:
+            return self.send_json(200, self.service.list_jobs())
+        if len(parts) in (2, 3) and parts[0] == 'jobs' and parts[1].isdigit():
+            job = self.service.get_job(int(parts[1]))
+            if not job:
+                return self.send_json(404, {'error': 'job não encontrado'})
+            if len(parts) == 2:
+                return self.send_json(200, job)
+            if parts[2] == 'log':
+                return self.stream_log(job)
+        self.send_json(404, {'error': 'rota não encontrada'})
+
+    def stream_log(self, job: Dict) -> None:
+        """Transmite o log do job, acompanhando a saída enquanto ele estiver na fila ou rodando"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        path = self.service.log_path(job['id'])
+        offset = 0
+        try:
+            while True:
+                if os.path.exists(path):
+                    with open(path, 'rb') as f:
+                        f.seek(offset)
+                        chunk = f.read()
+                    if chunk:
+                        self.wfile.write(chunk)
+                        self.wfile.flush()
+                        offset += len(chunk)
+
+                if job['status'] not in ('queued', 'running'):
+                    break
+                time.sleep(1)
+                job = self.service.get_job(job['id'])
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):
+        print(f"🌐 {self.address_string()} {format % args}")
+
+
+def load_service_config(path: Optional[str]) -> Dict:
+    """Carrega a configuração do serviço (arquivo JSON)"""
+    if not path:
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serviço HTTP de deploy com fila de jobs")
+    parser.add_argument('--config', help="Arquivo JSON de configuração do serviço")
+    parser.add_argument('--host', help="Endereço de escuta (padrão: 127.0.0.1)")
+    parser.add_argument('--port', type=int, help="Porta da API (padrão: 8787)")
+    parser.add_argument('projects', nargs='*', help="Caminhos dos projetos gerenciados")
+    cli = parser.parse_args()
+
+    # Configurações (credenciais de GitHub/VPS vêm das variáveis DEPLOY_* lidas pelo deploy.py)
+    config = load_service_config(cli.config)
+    host = cli.host or config.get('host', '127.0.0.1')
+    port = cli.port or config.get('port', 8787)
+    projects = cli.projects or config.get('projects', [])
+    if not projects:
+        print("❌ Nenhum projeto configurado. Informe os caminhos ou \"projects\" no arquivo de configuração.")
+        sys.exit(1)
+
+    service = DeployService(
+        projects,
+        state_dir=config.get('state_dir', "~/.autodeploy/service"),
+        workers=config.get('workers', 2),
+        coalesce_window=config.get('coalesce_window', 10.0),
+        coalesce_max_delay=config.get('coalesce_max_delay', 60.0),
+        job_timeout=config.get('job_timeout', 1800),
+    )
+    service.start_workers()
+
+    DeployRequestHandler.service = service
+    DeployRequestHandler.api_token = os.environ.get('DEPLOY_SERVICE_TOKEN') or config.get('token')
+    DeployRequestHandler.webhook_secret = os.environ.get('DEPLOY_WEBHOOK_SECRET') or config.get('webhook_secret')
+
+    server = ThreadingHTTPServer((host, port), DeployRequestHandler)
+    print(f"🚀 Serviço de deploy escutando em http://{host}:{port}")
+    print(f"📂 Projetos: {', '.join(service.projects)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🔒 Serviço de deploy encerrado")